@@ -1,8 +1,22 @@
-import sqlite3, requests, pandas as pd
+import sqlite3, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import quote
 from datetime import datetime, timedelta, UTC
 import logging, time
+import hashlib, json, os, threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any  # for input type hints
+try:
+    import orjson # ~3x faster than stdlib json on big payloads
+except ImportError:
+    orjson = None # stdlib fallback keeps the pipeline runnable
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    return orjson.dumps(obj) if orjson else json.dumps(obj)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -17,64 +31,224 @@ cols = [
 
 dp_path = "data/generation.db"
 table  = "mix"
+daily_table = "mix_daily" # materialized daily averages for the dashboard
+
+# shared session: keep-alive skips a TCP+TLS handshake per call and
+# transient 5xx from the NESO gateway get retried with backoff
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+))
 
-def build_time_window():
-    #take first few years to backfill, then only 3 days form then on
+def build_time_window(last_epoch: int = None):
+    #incremental: start from the newest row already in the db (minus a small
+    #overlap for late-arriving revisions); fall back to 3 days on an empty db
     now = datetime.now(UTC)
-    start_iso = (now - timedelta(days=3)).strftime("%Y-%m-%dT%H:%M:%SZ") #3 days ago in utc
-    #strftime turns datetime into astring in format you choose 
+    if last_epoch is not None:
+        start = datetime.fromtimestamp(last_epoch, UTC) - timedelta(hours=12) #re-fetch a little overlap
+    else:
+        start = now - timedelta(days=3) #3 days ago in utc
+    start_iso = start.strftime("%Y-%m-%dT%H:%M:%SZ")
+    #strftime turns datetime into astring in format you choose
     end_iso   = now.strftime("%Y-%m-%dT%H:%M:%SZ") #now in utc
-    return start_iso, end_iso 
+    return start_iso, end_iso
+
+def build_day_windows(start_iso: str, end_iso: str):
+    #split [start, end) into day-sized (start, end) pairs so each API call
+    #returns a small payload and the calls can run in parallel
+    fmt = "%Y-%m-%dT%H:%M:%SZ"
+    start = datetime.strptime(start_iso, fmt).replace(tzinfo=UTC)
+    end   = datetime.strptime(end_iso, fmt).replace(tzinfo=UTC)
+    windows = []
+    t = start
+    while t < end:
+        t_next = min(t + timedelta(days=1), end)
+        windows.append((t.strftime(fmt), t_next.strftime(fmt)))
+        t = t_next
+    return windows
+
+def fetch_records_parallel(base: str, windows: List[tuple], max_workers: int = 6):
+    #one request per day window via the pooled SESSION; the PK-keyed upsert
+    #doesn't care about row order so chunks are simply concatenated
+    def fetch_one(window):
+        s, e = window
+        return fetch_records_from_api(base, build_sql_query(cols, RID, s, e))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        chunks = list(pool.map(fetch_one, windows))
+    return [rec for chunk in chunks for rec in chunk]
 
 def build_sql_query(cols: List[str], RID: str, start_iso: str, end_iso: str):
     # build SQL (quote identifiers), call API
     cols_sql = ", ".join([f'"{c}"' for c in cols]) # one long string - "DATETIME", "GAS", "COAL", "NUCLEAR", "WIND", "WIND_EMB", "HYDRO", "IMPORTS", "BIOMASS", "OTHER", "SOLAR", "STORAGE", "GENERATION", "CARBON_INTENSITY"
 
+    # no ORDER BY: the upsert is keyed on DATETIME so row order doesn't matter,
+    # and skipping it saves the API a sort over the window
     sql = ( #sql query to send to API
-        f'SELECT {cols_sql} ' 
+        f'SELECT {cols_sql} '
         f'FROM "{RID}" '
-        f'WHERE "DATETIME" >= \'{start_iso}\' AND "DATETIME" < \'{end_iso}\' '
-        f'ORDER BY "DATETIME"'
+        f'WHERE "DATETIME" >= \'{start_iso}\' AND "DATETIME" < \'{end_iso}\''
     )
     return sql
 
+cache_path = "cache/http_cache.db"
+cache_ttl  = 1800 # seconds - the window always ends at "now", so keep it short
+cache_max_age = 7 * 24 * 3600 # evict entries older than a week
+
+def _cache_con():
+    #open (and lazily create) the response cache db
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    con = sqlite3.connect(cache_path)
+    con.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, ts REAL, body BLOB)")
+    return con
+
+def cache_get(sql: str, ttl: float = cache_ttl):
+    #return the cached records for this query, or None if missing/stale
+    key = hashlib.sha1(sql.encode()).hexdigest()
+    con = _cache_con()
+    try:
+        row = con.execute("SELECT ts, body FROM responses WHERE key = ?", (key,)).fetchone()
+    finally:
+        con.close()
+    if row and time.time() - row[0] < ttl:
+        return json_loads(row[1])
+    return None
+
+def cache_put(sql: str, records: List[Dict[str, Any]]):
+    #store the records and drop anything older than a week while we're here
+    key = hashlib.sha1(sql.encode()).hexdigest()
+    con = _cache_con()
+    try:
+        with con:
+            con.execute("DELETE FROM responses WHERE ts < ?", (time.time() - cache_max_age,))
+            con.execute("INSERT OR REPLACE INTO responses (key, ts, body) VALUES (?, ?, ?)",
+                        (key, time.time(), json_dumps(records)))
+    finally:
+        con.close()
+
 def fetch_records_from_api(base: str, sql: str):
-    #fetch records using SQL query
-    resp = requests.get(f"{base}/datastore_search_sql", params={"sql": sql}, timeout=60)
+    #fetch records using SQL query, via the local response cache when fresh
+    cached = cache_get(sql)
+    if cached is not None:
+        logging.info("Cache hit. Records: %d", len(cached))
+        return cached
+    resp = SESSION.get(f"{base}/datastore_search_sql", params={"sql": sql}, timeout=60)
     if resp.status_code != 200:
         raise SystemExit(f"HTTP {resp.status_code}") #program immediately and prints your message. (It exits like sys.exit(...) with that text.)
-    records = resp.json()["result"]["records"]
+    records = json_loads(resp.content)["result"]["records"]
     if not records:
         print("No rows returned")
     logging.info("API ok (200). Records fetched: %d", len(records))
+    cache_put(sql, records)
     return records #lsit of dits - records = [
 #   {"DATETIME": "2025-10-20T20:30:00Z", "GAS": "11691.0", "COAL": "4312.0"},
 #   {"DATETIME": "2025-10-20T21:00:00Z", "GAS": "12050.0", "COAL": "4100.0"},
 # ]
 
-def to_dataframe_clean(records: List[Dict[str, Any]], cols: List[str]):
-    #change datatypes, drop NaN's for date col, drop duplicate date records, sort by date
-    df = pd.DataFrame.from_records(records)[cols] #creates df from records (the reponse)
-    df["DATETIME"] = pd.to_datetime(df["DATETIME"], utc=True, errors="coerce") 
-    other_cols = [c for c in cols if c != "DATETIME"] 
-    for c in other_cols:
-        df[c] = pd.to_numeric(df[c], errors="coerce") 
-    df = df.dropna(subset=["DATETIME"]) 
-    df = df.drop_duplicates(subset=["DATETIME"]) 
-    df = df.sort_values("DATETIME") 
-    logging.info("After clean: %d rows", len(df))
-    return df
-
-def ensure_table_exists(cur: sqlite3.Cursor, table: str): #curser for db and table of db 
-    #create table if not exists in db
-    cur.execute(f"""
-        CREATE TABLE IF NOT EXISTS {table} (
-            DATETIME TEXT PRIMARY KEY,
+def iter_rows(records: List[Dict[str, Any]], cols: List[str]):
+    #yields cleaned tuples straight from the API records - no DataFrame in between.
+    #DATETIME is stored as unix-epoch seconds: an 8-byte integer PK instead of a
+    #20-byte ISO string, so comparisons and the b-tree stay small.
+    #drops rows with a missing/unparseable/duplicate DATETIME and coerces the rest to float
+    other_cols = [c for c in cols if c != "DATETIME"]
+    seen = set() # DATETIMEs already yielded
+    for rec in records:
+        dt = rec.get("DATETIME")
+        if not dt or dt in seen:
+            continue
+        seen.add(dt)
+        try:
+            # fromisoformat is the C fast path (~10x strptime); handles the trailing Z on py3.11+
+            epoch = int(datetime.fromisoformat(dt).timestamp())
+        except ValueError:
+            continue
+        vals = [epoch]
+        for c in other_cols:
+            v = rec.get(c)
+            try:
+                vals.append(float(v) if v not in (None, "") else None)
+            except (TypeError, ValueError):
+                vals.append(None) # bad cell -> NULL, keep the row
+        yield tuple(vals)
+
+_con = None # shared connection, reused across ingest invocations
+_con_lock = threading.Lock()
+
+def get_connection():
+    #singleton connection: repeat ingests (e.g. triggered from Streamlit) reuse
+    #the tuned connection and sqlite3's statement cache keeps the upsert prepared
+    global _con
+    with _con_lock:
+        if _con is None:
+            _con = sqlite3.connect(dp_path, check_same_thread=False)
+            tune_connection(_con)
+        return _con
+
+def tune_connection(con: sqlite3.Connection):
+    #pragmas for bulk inserts: WAL + NORMAL sync avoids an fsync per commit,
+    #bigger page cache + in-memory temp store keep the work off disk
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA cache_size=-65536") # ~64MB, negative = KB units
+
+table_columns_sql = """
+            DATETIME INTEGER PRIMARY KEY,
             GAS REAL, COAL REAL, NUCLEAR REAL, WIND REAL, WIND_EMB REAL, HYDRO REAL,
             IMPORTS REAL, BIOMASS REAL, OTHER REAL, SOLAR REAL, STORAGE REAL,
             GENERATION REAL, CARBON_INTENSITY REAL
-        )
-    """)
+"""
+
+def ensure_table_exists(cur: sqlite3.Cursor, table: str): #curser for db and table of db
+    #create table if not exists in db. WITHOUT ROWID puts the data in the
+    #DATETIME PK b-tree itself, so upserts and range scans do one lookup
+    #instead of PK-index + rowid-table
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {table} ({table_columns_sql}) WITHOUT ROWID")
+    migrate_table_schema(cur, table)
+
+def ensure_daily_table_exists(cur: sqlite3.Cursor):
+    #daily averages keyed by ISO day - the dashboard reads these instead of
+    #thousands of half-hourly rows on long windows
+    daily_cols = ", ".join(f"{c} REAL" for c in cols if c != "DATETIME")
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {daily_table} (day TEXT PRIMARY KEY, {daily_cols}) WITHOUT ROWID")
+
+def refresh_daily_table(cur: sqlite3.Cursor, start_epoch: int):
+    #recompute the daily rows touched by this ingest window. an empty daily
+    #table (fresh or just-migrated db with pre-existing history) gets a full
+    #backfill over mix instead of just the current window
+    avgs = ", ".join(f"AVG({c}) AS {c}" for c in cols if c != "DATETIME")
+    has_rows = cur.execute(f"SELECT EXISTS (SELECT 1 FROM {daily_table})").fetchone()[0]
+    where, params = ("WHERE DATETIME >= ?", (start_epoch,)) if has_rows else ("", ())
+    cur.execute(
+        f"INSERT OR REPLACE INTO {daily_table} "
+        f"SELECT date(DATETIME, 'unixepoch') AS day, {avgs} "
+        f"FROM {table} {where} GROUP BY day",
+        params,
+    )
+
+def migrate_table_schema(cur: sqlite3.Cursor, table: str):
+    #one-off rebuild for dbs created before the WITHOUT ROWID / epoch changes
+    row = cur.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone()
+    if row is None:
+        return
+    old_sql = row[0].upper()
+    needs_rowid = "WITHOUT ROWID" not in old_sql
+    needs_epoch = "DATETIME TEXT" in old_sql
+    if not (needs_rowid or needs_epoch):
+        return
+    logging.info("Migrating '%s' to WITHOUT ROWID / epoch DATETIME", table)
+    # old dbs stored DATETIME as ISO text - convert to unix seconds on the way over
+    dt_expr = "CAST(strftime('%s', DATETIME) AS INTEGER)" if needs_epoch else "DATETIME"
+    other = ", ".join(c for c in cols if c != "DATETIME")
+    cur.execute(f"CREATE TABLE {table}_new ({table_columns_sql}) WITHOUT ROWID")
+    cur.execute(f"INSERT INTO {table}_new SELECT {dt_expr}, {other} FROM {table}")
+    cur.execute(f"DROP TABLE {table}")
+    cur.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    # close the implicit transaction the copy opened, so the ingest batch
+    # can BEGIN IMMEDIATE afterwards
+    cur.connection.commit()
 
 def build_upsert_sql_query(cols: List[str], table: str): #cols: list of col names table:name of table in db
     col_list = ",".join(cols)                        # i.e.DATETIME,GAS,...
@@ -90,45 +264,41 @@ def build_upsert_sql_query(cols: List[str], table: str): #cols: list of col name
         f"INSERT INTO {table} ({col_list}) VALUES ({placeholders}) " 
         f"ON CONFLICT(DATETIME) DO UPDATE SET {updates}"
     )
-    return upsert_sql #retunr upsert query 
-
-def build_rows(df: pd.DataFrame, cols: List[str]): 
-    #takes df and builds a nested list to represent df. e.g. [["2025-10-21T10:00:00Z", 12050.0, 4100.0, 8200.0],["2025-10-21T10:30:00Z", 11800.0, 4200.0, 7900.0]
-    rows = []
-    for _, r in df.iterrows(): # r is a series object - a row of values 
-        vals = [] 
-        for col in cols:
-            if col == "DATETIME":
-                vals.append(r["DATETIME"].strftime("%Y-%m-%dT%H:%M:%SZ"))
-            else:
-                vals.append(r[col])
-        rows.append(vals) # is the new data fecthed 
- 
-    return rows
+    return upsert_sql #retunr upsert query
+
+UPSERT_SQL = build_upsert_sql_query(cols, table) # cols/table are constants, build once at import
 
 def main():
     t0 = time.time()
     logging.info("Ingest started")
-    start_iso, end_iso = build_time_window()
-    logging.info("Window %s → %s", start_iso, end_iso)
-    sql = build_sql_query(cols, RID, start_iso, end_iso)
-    records = fetch_records_from_api(base, sql)
-    df = to_dataframe_clean(records, cols)
 
-    con = sqlite3.connect(dp_path)
+    con = get_connection()
     cur = con.cursor()
     ensure_table_exists(cur, table)
+    ensure_daily_table_exists(cur)
 
-    upsert_query = build_upsert_sql_query(cols, table)
-    rows = build_rows(df, cols)
+    # watermark: only ask the API for rows newer than what we already hold
+    last_epoch = cur.execute(f"SELECT MAX(DATETIME) FROM {table}").fetchone()[0]
+    start_iso, end_iso = build_time_window(last_epoch)
+    logging.info("Window %s → %s", start_iso, end_iso)
+    windows = build_day_windows(start_iso, end_iso)
+    records = fetch_records_parallel(base, windows)
 
-    # run
-    cur.executemany(upsert_query, rows) #used t iterate over df and apply upserts
+    # run - one explicit transaction around the whole batch so sqlite fsyncs once,
+    # not once per statement. connection stays open for the next invocation.
+    # executemany consumes the generator directly so rows are never all in RAM
+    # (no trace callback / authorizer is installed, keeping the statement loop lean)
+    cur.execute("BEGIN IMMEDIATE")
+    cur.executemany(UPSERT_SQL, iter_rows(records, cols))
+    n_rows = cur.rowcount
+    # re-aggregate the days this window touched (from midnight of the first day)
+    window_start = datetime.strptime(start_iso, "%Y-%m-%dT%H:%M:%SZ").replace(
+        hour=0, minute=0, second=0, tzinfo=UTC)
+    refresh_daily_table(cur, int(window_start.timestamp()))
     con.commit()
-    con.close()
 
-    logging.info("Upserted %d rows into %s → table '%s' (%.2fs)", len(rows), dp_path, table, time.time() - t0)
-    print(f"Upserted {len(rows)} rows into {dp_path} → table '{table}'")
+    logging.info("Upserted %d rows into %s → table '%s' (%.2fs)", n_rows, dp_path, table, time.time() - t0)
+    print(f"Upserted {n_rows} rows into {dp_path} → table '{table}'")
 
 if __name__ == "__main__":
     main()
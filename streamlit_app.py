@@ -1,13 +1,77 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta, UTC
 import logging, time
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 db_path = "data/generation.db"
 table   = "mix"
+daily_table = "mix_daily" # daily averages materialized at ingest time
+
+fuels = ["GAS","WIND","NUCLEAR","SOLAR","HYDRO","COAL","BIOMASS","IMPORTS","OTHER","STORAGE"] #fuels we want to plot
+
+def day_to_epoch(d: date):
+    #midnight UTC of the given day as unix seconds - matches the INTEGER
+    #DATETIME column the ingest writes
+    return int(datetime(d.year, d.month, d.day, tzinfo=UTC).timestamp())
+
+@st.cache_data(ttl=600, show_spinner=False) #memoised per (start, end) so widget reruns skip the DB
+def load_metrics(start_epoch: int, end_epoch: int):
+    #row count + mean carbon intensity, aggregated inside SQLite so only
+    #two numbers cross into Python
+    con = sqlite3.connect(db_path)
+    row = con.execute(
+        f"SELECT COUNT(*), AVG(CARBON_INTENSITY) FROM {table} "
+        f"WHERE DATETIME >= :s AND DATETIME < :e",
+        {"s": start_epoch, "e": end_epoch},
+    ).fetchone()
+    con.close()
+    return row[0], row[1]
+
+@st.cache_data(ttl=600, show_spinner=False) #memoised per (start, end) so widget reruns skip the DB
+def load_series(start_epoch: int, end_epoch: int):
+    #pull only the charted columns for the selected window. windows over 3 days
+    #read the materialized daily averages (a handful of rows) instead of
+    #thousands of half-hourly ones
+    t0 = time.time()
+    con = sqlite3.connect(db_path)
+    value_cols = ", ".join(fuels + ["CARBON_INTENSITY"])
+    params = {"s": start_epoch, "e": end_epoch}
+    daily_sql = f"""
+      SELECT day, {value_cols} FROM {daily_table}
+      WHERE day >= date(:s, 'unixepoch') AND day < date(:e, 'unixepoch')
+      ORDER BY day
+    """
+    base_sql = f"""
+      SELECT DATETIME, {value_cols} FROM {table}
+      WHERE DATETIME >= :s AND DATETIME < :e
+      ORDER BY DATETIME
+    """
+    use_daily = end_epoch - start_epoch > 3 * 86400
+    if use_daily:
+        cur = con.execute(daily_sql, params)
+        rows = cur.fetchall()
+        if not rows: #daily table may not cover this window yet - use the base table
+            use_daily = False
+    if not use_daily:
+        cur = con.execute(base_sql, params)
+        rows = cur.fetchall()
+    df = pd.DataFrame(rows, columns=[d[0] for d in cur.description]) #skips read_sql_query's per-row type inspection
+    con.close()
+    logging.info("SQL returned %d rows in %.2fs", len(df), time.time() - t0)
+    # conversions are safe on an empty frame, and always leave a DATETIME column
+    if use_daily:
+        df["DATETIME"] = pd.to_datetime(df.pop("day"), format="%Y-%m-%d", utc=True) #ISO day -> midnight UTC
+    else:
+        df["DATETIME"] = pd.to_datetime(df["DATETIME"], unit="s", utc=True) #epoch seconds -> tz-aware timestamps
+
+    # downcast MW/gCO2 columns to float32 - plenty of precision for charting
+    # and halves the frame's memory on long date ranges
+    num_cols = [c for c in df.columns if c != "DATETIME"]
+    df[num_cols] = df[num_cols].astype("float32")
+    return df
 
 def main():
     st.set_page_config(page_title="GB Generation Mix", layout="wide")
@@ -18,47 +82,33 @@ def main():
     d_start = c1.date_input("Start (UTC day)", value=date.today() - timedelta(days=7)) #Calling c1.date_input(...) places a date picker inside the left column.
 # Calling c2.date_input(...) places another date picker inside the right column.
     d_end   = c2.date_input("End (UTC day)",   value=date.today())
-    start_iso = f"{d_start}T00:00:00Z" #turns start date intoa. timestamp 
-    end_iso   = f"{d_end}T23:59:59Z"
+    start_epoch = day_to_epoch(d_start) #start of first day
+    end_epoch   = day_to_epoch(d_end + timedelta(days=1)) #exclusive end: start of day after last
 
-    logging.info("App query window %s → %s", start_iso, end_iso)
+    logging.info("App query window %s → %s", start_epoch, end_epoch)
 
-#takes the input dates and uses sql query to make a df
+#takes the input dates and uses sql queries to make metrics + a df
     # Load from SQLite between start/end
-    t0 = time.time()
-    con = sqlite3.connect(db_path)
-    sql = f"""
-      SELECT * FROM {table}
-      WHERE DATETIME >= '{start_iso}' AND DATETIME <= '{end_iso}'
-      ORDER BY DATETIME
-    """
-    df = pd.read_sql_query(sql, con)
-    con.close()
-    logging.info("SQL returned %d rows in %.2fs", len(df), time.time() - t0)
-
-    # Handle empty + fix datetime
-    if df.empty:
+    n_rows, avg_ci = load_metrics(start_epoch, end_epoch)
+    if not n_rows:
         st.warning("No data yet. Run `python ingest.py` first.")
         st.stop()
-    df["DATETIME"] = pd.to_datetime(df["DATETIME"], utc=True, errors="coerce") #makes utc column values and fills misinng with NaT (missing placeholder)
-    df = df.dropna(subset=["DATETIME"]) #drops rows with missing datetime column vlaue 
+    df = load_series(start_epoch, end_epoch)
 
-    # Quick metrics
-    st.metric("Rows", len(df))
-    if "CARBON_INTENSITY" in df.columns and not df["CARBON_INTENSITY"].empty: #if column there an not empty...
-        st.metric("Avg carbon intensity (gCO₂/kWh)", f"{df['CARBON_INTENSITY'].mean():.1f}") #get the mean and do to idp
+    # Quick metrics - aggregated server-side, no pandas pass
+    st.metric("Rows", n_rows)
+    if avg_ci is not None:
+        st.metric("Avg carbon intensity (gCO₂/kWh)", f"{avg_ci:.1f}")
 
-    # Charts
-    fuels = ["GAS","WIND","NUCLEAR","SOLAR","HYDRO","COAL","BIOMASS","IMPORTS","OTHER","STORAGE"]#fuels we want to plot 
-    fuels = [c for c in fuels if c in df.columns] #Keep only the fuels that actually exist as columns in your DataFrame.
+    chart_df = df.set_index("DATETIME") #index once, both charts share it
 
     st.subheader("Generation (MW) by fuel")
     if fuels:
-        st.line_chart(df.set_index("DATETIME")[fuels]) #use dateetime as x axis anf fuels on y
+        st.line_chart(chart_df[fuels]) #use dateetime as x axis anf fuels on y
 
     st.subheader("Average carbon intensity (gCO₂/kWh)") # seond chart being made
     if "CARBON_INTENSITY" in df.columns:
-        st.line_chart(df.set_index("DATETIME")["CARBON_INTENSITY"]) #of carbon intensity over time 
+        st.line_chart(chart_df["CARBON_INTENSITY"]) #of carbon intensity over time
 
 if __name__ == "__main__":
     main()